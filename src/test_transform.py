@@ -1,5 +1,7 @@
 import transform
 import unittest
+import warnings
+from unittest import mock
 
 import numpy as np
 import sys
@@ -211,6 +213,205 @@ class TestTransformVectorTransform(unittest.TestCase):
         self.assertTrue(np.allclose(res, (55*np.cos(10) - 45*np.sin(10), 55*np.cos(10) + 45*np.sin(10))))
 
 
+class TestTransformBatch(unittest.TestCase):
+    def setUp(self):
+        # the example NAC image used by `transform.visualize`
+        self.imagesize = transform._IMAGESIZE
+        self.corner_ur = transform._CORNER_UR_B
+        self.corner_ul = transform._CORNER_UL_B
+        self.corner_ll = transform._CORNER_LL_B
+        self.image = (self.corner_ur, self.corner_ul, self.corner_ll, self.imagesize)
+        self.rng = np.random.default_rng(42)
+
+    def test_matches_single_point_transform(self):
+        points = np.array([[0, 0], [5064, 0], [0, 52224], [1090.2268219, 4951.45690823], [4346.92008209, 47847.70596313]])
+        res = transform.transform_batch(points, *self.image)
+        expected = np.array([transform.transform(p, *self.image) for p in points])
+        self.assertEqual(res.shape, points.shape)
+        self.assertTrue(np.allclose(res, expected))
+        self.assertTrue(np.allclose(res[0], self.corner_ll))
+
+    def test_affine_is_cached(self):
+        affine = transform.build_affine(*self.image)
+        self.assertIs(affine, transform.build_affine(self.corner_ur.copy(), *self.image[1:]))
+        self.assertFalse(affine.M.flags.writeable)
+        self.assertTrue(np.allclose(affine.t, self.corner_ll))
+
+    @unittest.skipUnless(transform.njit, "numba is not installed")
+    def test_large_batch_matches_numpy(self):
+        points = self.rng.random((1000, 2)) * self.imagesize
+        expected = transform.transform_batch(points, *self.image)
+        with mock.patch.object(transform, 'NUMBA_MIN_POINTS', 0):
+            res = transform.transform_batch(points, *self.image)
+        self.assertTrue(np.allclose(res, expected))
+
+    def test_soa_matches_batch(self):
+        points = self.rng.random((100, 2)) * self.imagesize
+        expected = transform.transform_batch(points, *self.image)
+        affine = transform.build_affine(*self.image)
+        longs, lats = transform.transform_batch_soa(points[:, 0], points[:, 1], affine.M, affine.t)
+        self.assertTrue(np.allclose(np.column_stack((longs, lats)), expected))
+        with self.assertRaises(ValueError):
+            transform.transform_batch_soa(points[:, 0], points[:10, 1], affine.M, affine.t)
+
+    def test_warns_once_for_points_outside_image(self):
+        imagesize = np.array([10, 60])
+        corner_ur = np.array([30, 70])
+        corner_ul = np.array([20, 70])
+        corner_ll = np.array([20, 10])
+
+        points = np.array([[-1, 0], [11, 0], [5, 30]])
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            transform.transform_batch(points, corner_ur, corner_ul, corner_ll, imagesize)
+        self.assertEqual(len(caught), 1)
+        self.assertIn("2 point x coordinates", str(caught[0].message))
+
+    def test_rejects_too_different_scales(self):
+        corner_ur = np.array([30, 70])
+        corner_ul = np.array([20, 70])
+        corner_ll = np.array([20, 10])
+
+        with self.assertRaises(ValueError):
+            transform.build_affine(corner_ur, corner_ul, corner_ll, np.array([1, 1000]))
+
+    def test_grid_shape_is_kept(self):
+        grid = self.rng.random((3, 4, 2)) * self.imagesize
+        res = transform.transform(grid, *self.image)
+        expected = transform.transform_batch(grid.reshape(-1, 2), *self.image)
+        self.assertEqual(res.shape, grid.shape)
+        self.assertTrue(np.allclose(res.reshape(-1, 2), expected))
+
+    def test_grid_matches_batch(self):
+        affine = transform.build_affine(*self.image)
+        longs, lats = transform.transform_grid(5, 3, affine.M, affine.t)
+        xs, ys = np.meshgrid(np.arange(5), np.arange(3))
+        expected = transform.transform_batch(np.stack((xs, ys), axis=-1), *self.image)
+        self.assertEqual(longs.shape, (3, 5))
+        self.assertTrue(np.allclose(longs, expected[..., 0]))
+        self.assertTrue(np.allclose(lats, expected[..., 1]))
+        # crossing 0 longitude still wraps
+        wrapped, _ = transform.transform_grid(5, 3, affine.M, affine.t - (3.76, 0))
+        self.assertTrue((wrapped >= 0).all())
+        self.assertTrue((wrapped > 180).any())
+
+    def test_float32_precision(self):
+        points = self.rng.random((10000, 2)) * self.imagesize
+        res = transform.transform_batch(points, *self.image)
+        expected = transform.transform_batch(points, *self.image, dtype=np.float64)
+        self.assertEqual(res.dtype, np.float32)
+        self.assertLess(np.abs(res - expected).max(), 1e-5)
+
+    def test_out_is_reused(self):
+        points = self.rng.random((10, 2)) * self.imagesize
+        out = np.empty((10, 2), dtype=np.float32)
+        res = transform.transform_batch(points, *self.image, out=out)
+        self.assertIs(res, out)
+        self.assertTrue(np.allclose(out, transform.transform_batch(points, *self.image)))
+
+    def test_axis_aligned_image(self):
+        imagesize = np.array([10, 60])
+        corner_ur = np.array([30, 70])
+        corner_ul = np.array([20, 70])
+        corner_ll = np.array([20, 10])
+
+        affine = transform.build_affine(corner_ur, corner_ul, corner_ll, imagesize)
+        self.assertTrue(affine.axis_aligned)
+        self.assertTrue(np.allclose(affine.M, np.diag((1, 1))))
+        res = transform.transform_batch(np.array([[0, 0], [10, 60]]), corner_ur, corner_ul, corner_ll, imagesize)
+        self.assertTrue(np.allclose(res, [[20, 10], [30, 70]]))
+
+    def test_multiple_images_match_single_images(self):
+        imagesize = np.array([[5064, 52224], [5064, 52224], [10, 60]])
+        corner_ur = np.array([[3.73, 116.53], [3.82, 116.49], [30, 70]])
+        corner_ul = np.array([[3.64, 116.53], [3.74, 116.49], [20, 70]])
+        corner_ll = np.array([[3.62, 115.59], [3.75, 115.54], [20, 10]])
+
+        M, t, _ = transform.build_affine_batch(corner_ur, corner_ul, corner_ll, imagesize)
+        points = self.rng.random((3, 4, 2)) * imagesize[:, None, :]
+        res = transform.transform_batch_multi(points, M, t)
+        for k in range(3):
+            affine = transform.build_affine(corner_ur[k], corner_ul[k], corner_ll[k], imagesize[k])
+            self.assertTrue(np.allclose(M[k], affine.M))
+            self.assertTrue(np.allclose(t[k], affine.t))
+            expected = transform.transform_batch(points[k], corner_ur[k], corner_ul[k], corner_ll[k], imagesize[k])
+            self.assertTrue(np.allclose(res[k], expected))
+
+    @unittest.skipUnless(transform.njit, "numba is not installed")
+    def test_out_on_numba_path(self):
+        points = self.rng.random((1000, 2)) * self.imagesize
+        expected = transform.transform_batch(points, *self.image)
+        out = np.empty((1000, 2), dtype=np.float32)
+        with mock.patch.object(transform, 'NUMBA_MIN_POINTS', 0):
+            res = transform.transform_batch(points, *self.image, out=out)
+            self.assertIs(res, out)
+            self.assertTrue(np.allclose(out, expected))
+
+            buffer = np.zeros((2000, 2), dtype=np.float32)
+            with self.assertRaises(ValueError):
+                transform.transform_batch(points, *self.image, out=buffer[:10])
+            self.assertFalse(buffer.any())
+            with self.assertRaises(ValueError):
+                transform.transform_batch(points, *self.image,
+                                          out=np.empty((1000, 2), dtype=np.int32))
+
+    def test_rotated_picture(self):
+        # a 10x10 degree square rotated by 45 degrees around its lower-left corner
+        h = 10 / np.sqrt(2)
+        imagesize = np.array([100, 100])
+        corner_ll = np.array([50, 10])
+        corner_ul = np.array([50 - h, 10 + h])
+        corner_ur = np.array([50, 10 + 2 * h])
+        corner_lr = np.array([50 + h, 10 + h])
+
+        points = np.array([[0, 0], [0, 100], [100, 100], [100, 0], [50, 50]])
+        expected = np.array([corner_ll, corner_ul, corner_ur, corner_lr, [50, 10 + h]])
+        res = transform.transform_batch(points, corner_ur, corner_ul, corner_ll, imagesize, dtype=np.float64)
+        self.assertTrue(np.allclose(res, expected, rtol=0, atol=1e-9))
+        for p, e in zip(points, expected):
+            self.assertTrue(np.allclose(transform.transform(p, corner_ur, corner_ul, corner_ll, imagesize), e,
+                                        rtol=0, atol=1e-9))
+
+
+class TestHelpers(unittest.TestCase):
+    def test_calc_angle(self):
+        self.assertAlmostEqual(transform.calc_angle((0, 1), (1, 0)), np.pi / 2)
+        self.assertAlmostEqual(transform.calc_angle((1, 0), (0, 1)), -np.pi / 2)
+        # wrapped into [-pi, pi] instead of -3/2 pi
+        self.assertAlmostEqual(transform.calc_angle((-1, -1), (-1, 1)), np.pi / 2)
+        # stacked vectors
+        res = transform.calc_angle(np.array([[0, 1], [1, 1]]), np.array([[1, 0], [1, 0]]))
+        self.assertTrue(np.allclose(res, [np.pi / 2, np.pi / 4], rtol=0, atol=1e-12))
+
+    def test_distance_wraps_around(self):
+        self.assertAlmostEqual(transform.distance(np.array([359, 0]), np.array([1, 0])), 2)
+        self.assertAlmostEqual(transform.distance(np.array([0.5, 10]), np.array([359.5, 13])), np.hypot(1, 3))
+        self.assertAlmostEqual(transform.distance(np.array([20, 10]), np.array([23, 14])), 5)
+
+    def test_scale_accepts_tuple_imagesize(self):
+        res = transform.scale(np.array([1., 2.]), transform._CORNER_UR_B, transform._CORNER_UL_B,
+                              transform._CORNER_LL_B, (5064, 52224))
+        expected = np.array([1 * np.hypot(0.08, 0) / 5064, 2 * np.hypot(0.01, 0.95) / 52224])
+        self.assertTrue(np.allclose(res, expected, rtol=1e-12, atol=0))
+        with self.assertRaises(ValueError):
+            transform.scale(np.array([1., 2.]), transform._CORNER_UR_B, transform._CORNER_UL_B,
+                            transform._CORNER_LL_B, (1, 52224))
+
+    def test_steps_on_arrays_match_rows(self):
+        image = (transform._CORNER_UR_B, transform._CORNER_UL_B, transform._CORNER_LL_B)
+        points = transform._POINTS_B
+        for step, args in ((transform.scale, image + (transform._IMAGESIZE,)),
+                           (transform.rotate, image),
+                           (transform.transform_old, image + (transform._IMAGESIZE,))):
+            res = step(points, *args)
+            expected = np.array([step(tuple(p), *args) for p in points])
+            self.assertEqual(res.shape, points.shape)
+            self.assertTrue(np.allclose(res, expected, rtol=0, atol=1e-12))
+        res = transform.translate(points, transform._CORNER_LL_B)
+        expected = np.array([transform.translate(p, transform._CORNER_LL_B) for p in points])
+        self.assertTrue(np.allclose(res, expected, rtol=0, atol=1e-12))
+
+
 #    def test_north_poll_edge_case(self):
 #        self.fail()
 #